@@ -5,22 +5,51 @@ Creates a proper navigation structure and converts all links to work offline
 """
 
 import os
-import hashlib
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
+from lxml import html
+import orjson
 import logging
 import re
 
+from triz_common import build_image_index, convert_worker, DISABLED_STYLE, EXTERNAL_LINK_ATTRS, HTML_PARSER, init_worker, is_valid_triz_url, normalize_url, PLACEHOLDER_IMG, read_page_rows, SITEMAP_TITLE_RE, url_hash, url_map_file, WIKI_URL
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Raw markers of anything convert_html_file_to_offline may rewrite
+_CANDIDATE_RE = re.compile(rb'<img|knowledge-base/triz/|wiki\.matriz\.org', re.IGNORECASE)
+
+# Navigation categories in priority order; each branch is a lookahead at the
+# start of the lowercased URL, so the first matching category wins
+_CATEGORY_RE = re.compile(
+    r'(?=.*(?:problem-identification|function-cost))(?P<pid>)'
+    r'|(?=.*(?:problem-solving|ariz|contradiction))(?P<ps>)'
+    r'|(?=.*(?:concept|substantiation))(?P<cs>)'
+    r'|(?=.*(?:tese|trend))(?P<tese>)'
+    r'|(?=.*(?:glossary|resource))(?P<res>)',
+    re.DOTALL
+)
+_CATEGORY_NAMES = {
+    'pid': 'Problem Identification Tools',
+    'ps': 'Problem Solving Tools',
+    'cs': 'Concept Substantiation',
+    'tese': 'TESE Trends',
+    'res': 'Resources',
+}
+
+# Reserved keys in the URL path trie (path segments never contain NUL)
+_TRIE_URL = '\0url'
+_TRIE_ANY = '\0any'
+
 class OfflineNavigationCreator:
     def __init__(self, output_dir="triz_content"):
         self.output_dir = output_dir
         self.html_dir = f"{output_dir}/html"
         self.data_dir = f"{output_dir}/data"
+        self.data_db = f"{output_dir}/data.sqlite"
         self.images_dir = f"{output_dir}/images"
         
         # Create a comprehensive URL mapping
@@ -28,19 +57,22 @@ class OfflineNavigationCreator:
         self.filename_to_url_map = {}
         self.page_titles = {}
         
+        self.images_available = os.path.isdir(self.images_dir)
+        self.image_index = build_image_index(self.images_dir)
+        
         # Load existing data
         self.load_existing_data()
+        self.build_url_trie()
         
     def load_existing_data(self):
         """Load data from existing files to create URL mappings"""
         logger.info("Loading existing data to create URL mappings...")
         
-        # First, try to load from crawl summary
-        summary_file = f"{self.output_dir}/crawl_summary.json"
+        # First, try to load from the crawler's URL map or crawl summary
+        summary_file = url_map_file(self.output_dir)
         if os.path.exists(summary_file):
             try:
-                with open(summary_file, 'r', encoding='utf-8') as f:
-                    summary = json.load(f)
+                summary = orjson.loads(Path(summary_file).read_bytes())
                 
                 # Create URL to filename mapping
                 for page in summary.get('pages', []):
@@ -57,49 +89,61 @@ class OfflineNavigationCreator:
             except Exception as e:
                 logger.warning(f"Error loading summary: {e}")
         
-        # If no summary, create mappings from data files
-        if os.path.exists(self.data_dir):
-            for data_file in os.listdir(self.data_dir):
-                if data_file.endswith('.json'):
-                    try:
-                        with open(f"{self.data_dir}/{data_file}", 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            url = data.get('url', '')
-                            html_file = data.get('html_file', '')
-                            title = data.get('title', '')
-                            if url and html_file:
-                                self.url_to_filename_map[url] = html_file
-                                self.filename_to_url_map[html_file] = url
-                                self.page_titles[html_file] = title
-                    except Exception as e:
-                        logger.warning(f"Error reading {data_file}: {e}")
+        # If no summary, create mappings from the crawler's page database,
+        # or from the per-page data files of crawls made before it
+        pages = []
+        if os.path.exists(self.data_db):
+            pages = read_page_rows(self.data_db)
+        elif os.path.exists(self.data_dir):
+            data_files = [f for f in os.listdir(self.data_dir) if f.endswith('.json')]
+            
+            # Overlap the file reads, then fill the maps in listing order
+            with ThreadPoolExecutor(max_workers=32) as executor:
+                pages = list(executor.map(self.read_data_file, data_files))
+            
+        for data in pages:
+            if data:
+                url = data.get('url', '')
+                html_file = data.get('html_file', '')
+                title = data.get('title', '')
+                if url and html_file:
+                    self.url_to_filename_map[url] = html_file
+                    self.filename_to_url_map[html_file] = url
+                    self.page_titles[html_file] = title
         
         logger.info(f"Created {len(self.url_to_filename_map)} URL mappings from data files")
     
+    def read_data_file(self, data_file):
+        """Read a single page data file, returning None if it can't be parsed"""
+        try:
+            return orjson.loads(Path(f"{self.data_dir}/{data_file}").read_bytes())
+        except Exception as e:
+            logger.warning(f"Error reading {data_file}: {e}")
+            return None
+    
     def normalize_url(self, url, base_url):
         """Normalize URL to absolute form"""
-        if url.startswith('#'):
-            return base_url
-        if url.startswith('javascript:'):
-            return base_url
-        if url.startswith('mailto:'):
-            return base_url
-            
-        try:
-            import urllib.parse
-            parsed = urllib.parse.urljoin(base_url, url)
-            # Remove fragments
-            parsed = urllib.parse.urlparse(parsed)
-            return urllib.parse.urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, parsed.query, ''))
-        except:
-            return base_url
+        return normalize_url(url, base_url)
     
     def is_valid_triz_url(self, url):
         """Check if URL is part of the TRIZ knowledge base"""
-        return (url.startswith('https://wiki.matriz.org') and 
-                '/knowledge-base/triz/' in url and
-                not url.endswith(('.pdf', '.zip', '.doc', '.docx')) and
-                '#' not in url)
+        return is_valid_triz_url(url)
+    
+    def url_path_segments(self, url):
+        """Split a URL's path (query and fragment left out) into the segments used as trie keys"""
+        return urlsplit(url).path.strip('/').split('/')
+    
+    def build_url_trie(self):
+        """Index known URLs by path segment for find_best_match_url"""
+        self.url_trie = {}
+        for known_url in self.url_to_filename_map:
+            node = self.url_trie
+            node.setdefault(_TRIE_ANY, known_url)
+            for segment in self.url_path_segments(known_url):
+                node = node.setdefault(segment, {})
+                # First known URL at or below this node
+                node.setdefault(_TRIE_ANY, known_url)
+            node.setdefault(_TRIE_URL, known_url)
     
     def find_best_match_url(self, target_url):
         """Find the best matching URL in our mapping"""
@@ -107,87 +151,86 @@ class OfflineNavigationCreator:
         if target_url in self.url_to_filename_map:
             return target_url
         
-        # Try to find partial matches
-        target_path = target_url.replace('https://wiki.matriz.org', '')
-        
-        for known_url in self.url_to_filename_map.keys():
-            known_path = known_url.replace('https://wiki.matriz.org', '')
-            
-            # Check if paths match
-            if target_path == known_path:
-                return known_url
-            
-            # Check if one is a subset of the other
-            if target_path.startswith(known_path) or known_path.startswith(target_path):
-                return known_url
+        # Walk the trie, remembering the deepest known page on the way
+        node = self.url_trie
+        best_match = None
+        for segment in self.url_path_segments(target_url):
+            node = node.get(segment)
+            if node is None:
+                return best_match
+            best_match = node.get(_TRIE_URL, best_match)
         
-        return None
+        # Whole path matched: fall back to a known page below it
+        return best_match or node.get(_TRIE_ANY)
     
     def convert_html_file_to_offline(self, html_file_path):
         """Convert a single HTML file to have offline links"""
         try:
-            with open(html_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            content = Path(html_file_path).read_bytes()
             
-            soup = BeautifulSoup(content, 'html.parser')
+            # Skip the parse entirely when nothing in the file could be rewritten
+            if not _CANDIDATE_RE.search(content):
+                return False
+            
+            tree = html.fromstring(content, parser=HTML_PARSER)
             modified = False
             
-            # Convert all anchor links
-            for link in soup.find_all('a', href=True):
-                href = link.get('href')
-                if href:
-                    # Normalize the URL
-                    normalized_url = self.normalize_url(href, 'https://wiki.matriz.org')
+            # Rewrite anchors and images in a single walk over the tree
+            for element in tree.iter('a', 'img'):
+                if element.tag == 'a':
+                    # Convert anchor links
+                    href = element.get('href')
+                    if href:
+                        # Normalize the URL
+                        normalized_url = normalize_url(href, WIKI_URL)
                     
-                    if self.is_valid_triz_url(normalized_url):
-                        # Find the best matching URL
-                        best_match = self.find_best_match_url(normalized_url)
+                        if is_valid_triz_url(normalized_url):
+                            # Find the best matching URL
+                            best_match = self.find_best_match_url(normalized_url)
+                            local_filename = self.url_to_filename_map.get(best_match) if best_match else None
                         
-                        if best_match and best_match in self.url_to_filename_map:
-                            # Rewrite to local file
-                            local_filename = self.url_to_filename_map[best_match]
-                            link['href'] = local_filename
-                            modified = True
-                            logger.debug(f"Rewrote link {href} -> {local_filename}")
-                        else:
-                            # If we don't have this page, disable the link
-                            link['href'] = '#'
-                            link['title'] = f"Page not available offline: {normalized_url}"
-                            link['style'] = 'color: #999; text-decoration: line-through;'
+                            if local_filename:
+                                # Rewrite to local file
+                                element.set('href', local_filename)
+                                modified = True
+                                logger.debug(f"Rewrote link {href} -> {local_filename}")
+                            else:
+                                # If we don't have this page, disable the link
+                                element.attrib.update({
+                                    'href': '#',
+                                    'title': f"Page not available offline: {normalized_url}",
+                                    'style': DISABLED_STYLE
+                                })
+                                modified = True
+                                logger.debug(f"Disabled link {href} (not available offline)")
+                        elif href.startswith(WIKI_URL):
+                            # External link - keep as is but add target="_blank"
+                            element.attrib.update(EXTERNAL_LINK_ATTRS)
                             modified = True
-                            logger.debug(f"Disabled link {href} (not available offline)")
-                    elif href.startswith('https://wiki.matriz.org'):
-                        # External link - keep as is but add target="_blank"
-                        link['target'] = '_blank'
-                        link['rel'] = 'noopener noreferrer'
-                        modified = True
-            
-            # Convert image sources to local files
-            for img in soup.find_all('img'):
-                src = img.get('src')
-                if src:
-                    normalized_url = self.normalize_url(src, 'https://wiki.matriz.org')
-                    if normalized_url.startswith('https://wiki.matriz.org'):
-                        # Check if we have this image locally
-                        if os.path.exists(self.images_dir):
-                            # Find the local image filename
-                            for local_img in os.listdir(self.images_dir):
-                                if local_img.startswith(hashlib.md5(normalized_url.encode()).hexdigest()):
-                                    img['src'] = f"../images/{local_img}"
+                else:
+                    # Convert image sources to local files
+                    src = element.get('src')
+                    if src:
+                        normalized_url = normalize_url(src, WIKI_URL)
+                        if normalized_url.startswith(WIKI_URL):
+                            # Check if we have this image locally
+                            if self.images_available:
+                                # Find the local image filename
+                                local_img = self.image_index.get(url_hash(normalized_url))
+                                if local_img:
+                                    element.set('src', f"../images/{local_img}")
                                     modified = True
                                     logger.debug(f"Rewrote image {src} -> ../images/{local_img}")
-                                    break
-                        else:
-                            # Image not available offline
-                            img['src'] = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZGRkIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzk5OSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPkltYWdlIG5vdCBhdmFpbGFibGUgb2ZmbGluZTwvdGV4dD48L3N2Zz4="
-                            img['alt'] = "Image not available offline"
-                            modified = True
-                            logger.debug(f"Replaced offline image {src} with placeholder")
+                            else:
+                                # Image not available offline
+                                element.attrib.update({'src': PLACEHOLDER_IMG, 'alt': "Image not available offline"})
+                                modified = True
+                                logger.debug(f"Replaced offline image {src} with placeholder")
             
             if modified:
-                # Write the modified content back
-                with open(html_file_path, 'w', encoding='utf-8') as f:
-                    f.write(str(soup))
+                # Write the modified content back, serialized straight to UTF-8
+                # from the whole document so the doctype is kept
+                Path(html_file_path).write_bytes(html.tostring(tree.getroottree(), encoding='utf-8'))
                 return True
             
             return False
@@ -202,15 +245,22 @@ class OfflineNavigationCreator:
             logger.error(f"HTML directory {self.html_dir} not found")
             return
         
-        html_files = [f for f in os.listdir(self.html_dir) if f.endswith('.html')]
-        logger.info(f"Found {len(html_files)} HTML files to convert")
+        with os.scandir(self.html_dir) as entries:
+            html_entries = [e for e in entries if e.name.endswith('.html') and e.is_file()]
+        logger.info(f"Found {len(html_entries)} HTML files to convert")
         
+        html_files = [e.name for e in html_entries]
+        html_paths = [e.path for e in html_entries]
+        
+        # Files are independent, so spread the parsing over all cores.
+        # The creator (URL map, trie, image index) is shipped once per worker.
         converted_count = 0
-        for html_file in html_files:
-            html_path = os.path.join(self.html_dir, html_file)
-            if self.convert_html_file_to_offline(html_path):
-                converted_count += 1
-                logger.info(f"Converted {html_file}")
+        with ProcessPoolExecutor(initializer=init_worker, initargs=(self,)) as executor:
+            results = executor.map(convert_worker, html_paths, chunksize=8)
+            for html_file, converted in zip(html_files, results):
+                if converted:
+                    converted_count += 1
+                    logger.info(f"Converted {html_file}")
         
         logger.info(f"Successfully converted {converted_count} HTML files to offline format")
     
@@ -233,21 +283,12 @@ class OfflineNavigationCreator:
         for filename, title in self.page_titles.items():
             url = self.filename_to_url_map.get(filename, '')
             
-            if 'problem-identification' in url.lower() or 'function-cost' in url.lower():
-                categories['Problem Identification Tools'].append((filename, title, url))
-            elif 'problem-solving' in url.lower() or 'ariz' in url.lower() or 'contradiction' in url.lower():
-                categories['Problem Solving Tools'].append((filename, title, url))
-            elif 'concept' in url.lower() or 'substantiation' in url.lower():
-                categories['Concept Substantiation'].append((filename, title, url))
-            elif 'tese' in url.lower() or 'trend' in url.lower():
-                categories['TESE Trends'].append((filename, title, url))
-            elif 'glossary' in url.lower() or 'resource' in url.lower():
-                categories['Resources'].append((filename, title, url))
-            else:
-                categories['Other'].append((filename, title, url))
+            match = _CATEGORY_RE.match(url.lower())
+            category = _CATEGORY_NAMES[match.lastgroup] if match else 'Other'
+            categories[category].append((filename, title, url))
         
         # Create the navigation index HTML
-        nav_html = f"""<!DOCTYPE html>
+        parts = [f"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -283,34 +324,36 @@ class OfflineNavigationCreator:
             <p><strong>Offline Links:</strong> All internal links converted for offline use</p>
             <p><strong>Navigation:</strong> Click any page title below to open the content</p>
         </div>
-"""
+"""]
         
         # Add each category
         for category_name, pages in categories.items():
             if pages:
-                nav_html += f"""
+                parts.append(f"""
         <div class="category">
             <h2>{category_name} ({len(pages)} pages)</h2>
             <div class="page-grid">
-"""
+""")
                 
                 for filename, title, url in sorted(pages, key=lambda x: x[1].lower()):
-                    nav_html += f"""
+                    parts.append(f"""
                 <div class="page-card">
                     <a href="html/{filename}" target="_blank">{title}</a>
                     <div class="page-url">{url}</div>
                 </div>
-"""
+""")
                 
-                nav_html += """
+                parts.append("""
             </div>
         </div>
-"""
+""")
         
-        nav_html += """
+        parts.append("""
     </div>
 </body>
-</html>"""
+</html>""")
+        
+        nav_html = "".join(parts)
         
         # Save the navigation index
         nav_file = f"{self.output_dir}/navigation_index.html"
@@ -361,11 +404,14 @@ class OfflineNavigationCreator:
             )
             
             # Make page titles clickable
-            for filename, title in self.page_titles.items():
-                content = content.replace(
-                    f'<div class="title">{filename}</div>',
-                    f'<div class="title"><a href="html/{filename}" target="_blank">{title}</a></div>'
-                )
+            def link_title(match):
+                filename = match.group(1)
+                title = self.page_titles.get(filename)
+                if title is None:
+                    return match.group(0)
+                return f'<div class="title"><a href="html/{filename}" target="_blank">{title}</a></div>'
+            
+            content = SITEMAP_TITLE_RE.sub(link_title, content)
             
             # Write the updated sitemap
             with open(sitemap_file, 'w', encoding='utf-8') as f:
@@ -378,7 +424,7 @@ class OfflineNavigationCreator:
     
     def create_new_sitemap(self):
         """Create a new sitemap if none exists"""
-        sitemap_html = f"""<!DOCTYPE html>
+        parts = [f"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -413,11 +459,11 @@ class OfflineNavigationCreator:
     </div>
     
     <h2>Pages (Click to Navigate Offline)</h2>
-"""
+"""]
         
         for filename, title in self.page_titles.items():
             url = self.filename_to_url_map.get(filename, '')
-            sitemap_html += f"""
+            parts.append(f"""
     <div class="page">
         <div class="title"><a href="html/{filename}" target="_blank">{title}</a></div>
         <div class="url">{url}</div>
@@ -425,11 +471,13 @@ class OfflineNavigationCreator:
             <p><strong>HTML File:</strong> <a href="html/{filename}" target="_blank">{filename}</a></p>
         </div>
     </div>
-"""
+""")
             
-        sitemap_html += """
+        parts.append("""
 </body>
-</html>"""
+</html>""")
+        
+        sitemap_html = "".join(parts)
         
         sitemap_file = f"{self.output_dir}/sitemap.html"
         with open(sitemap_file, 'w', encoding='utf-8') as f:
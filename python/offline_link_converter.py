@@ -6,11 +6,14 @@ Converts all internal links in HTML files to point to local files
 
 import os
 import hashlib
-import json
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from bs4 import BeautifulSoup
+from lxml import html
 import logging
 
+from triz_common import build_image_index, convert_worker, DISABLED_STYLE, EXTERNAL_LINK_ATTRS, HTML_PARSER, init_worker, is_valid_triz_url, normalize_url, PLACEHOLDER_IMG, read_page_rows, SITEMAP_TITLE_RE, url_hash, url_map_file, WIKI_URL
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -20,19 +23,24 @@ class OfflineLinkConverter:
         self.output_dir = output_dir
         self.html_dir = f"{output_dir}/html"
         self.data_dir = f"{output_dir}/data"
+        self.data_db = f"{output_dir}/data.sqlite"
         self.images_dir = f"{output_dir}/images"
+        self.manifest_file = f"{output_dir}/.conv_manifest.json"
+        
+        self.images_available = os.path.isdir(self.images_dir)
+        self.image_index = build_image_index(self.images_dir)
         
         # Load the crawl summary to get URL mappings
         self.url_to_filename_map = {}
         self.load_url_mappings()
         
     def load_url_mappings(self):
-        """Load URL to filename mappings from crawl summary"""
-        summary_file = f"{self.output_dir}/crawl_summary.json"
+        """Load URL to filename mappings from the crawler's URL map or summary"""
+        summary_file = url_map_file(self.output_dir)
         if os.path.exists(summary_file):
             try:
-                with open(summary_file, 'r', encoding='utf-8') as f:
-                    summary = json.load(f)
+                with open(summary_file, 'rb') as f:
+                    summary = orjson.loads(f.read())
                 
                 # Create URL to filename mapping
                 for page in summary.get('pages', []):
@@ -54,120 +62,111 @@ class OfflineLinkConverter:
             logger.error(f"HTML directory {self.html_dir} not found")
             return
             
-        # Read data files to get URL mappings
-        for data_file in os.listdir(self.data_dir):
-            if data_file.endswith('.json'):
-                try:
-                    with open(f"{self.data_dir}/{data_file}", 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        url = data.get('url', '')
-                        html_file = data.get('html_file', '')
-                        if url and html_file:
-                            self.url_to_filename_map[url] = html_file
-                except Exception as e:
-                    logger.warning(f"Error reading {data_file}: {e}")
+        # Read the crawler's page database to get URL mappings
+        if os.path.exists(self.data_db):
+            for data in read_page_rows(self.data_db):
+                url = data.get('url', '')
+                html_file = data.get('html_file', '')
+                if url and html_file:
+                    self.url_to_filename_map[url] = html_file
+        
+        # Crawls from before the database wrote one data file per page
+        elif os.path.exists(self.data_dir):
+            for data_file in os.listdir(self.data_dir):
+                if data_file.endswith('.json'):
+                    try:
+                        with open(f"{self.data_dir}/{data_file}", 'rb') as f:
+                            data = orjson.loads(f.read())
+                            url = data.get('url', '')
+                            html_file = data.get('html_file', '')
+                            if url and html_file:
+                                self.url_to_filename_map[url] = html_file
+                    except Exception as e:
+                        logger.warning(f"Error reading {data_file}: {e}")
         
         logger.info(f"Created {len(self.url_to_filename_map)} URL mappings from data files")
     
     def normalize_url(self, url, base_url):
         """Normalize URL to absolute form"""
-        if url.startswith('#'):
-            return base_url
-        if url.startswith('javascript:'):
-            return base_url
-        if url.startswith('mailto:'):
-            return base_url
-            
-        try:
-            import urllib.parse
-            parsed = urllib.parse.urljoin(base_url, url)
-            # Remove fragments
-            parsed = urllib.parse.urlparse(parsed)
-            return urllib.parse.urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, parsed.query, ''))
-        except:
-            return base_url
+        return normalize_url(url, base_url)
     
     def is_valid_triz_url(self, url):
         """Check if URL is part of the TRIZ knowledge base"""
-        return (url.startswith('https://wiki.matriz.org') and 
-                '/knowledge-base/triz/' in url and
-                not url.endswith(('.pdf', '.zip', '.doc', '.docx')) and
-                '#' not in url)
+        return is_valid_triz_url(url)
     
     def get_local_filename_for_url(self, url):
         """Get the local HTML filename for a given URL"""
         return self.url_to_filename_map.get(url, '')
     
     def convert_html_file_to_offline(self, html_file_path):
-        """Convert a single HTML file to have offline links"""
+        """Convert a single HTML file to have offline links (True rewritten, False unchanged, None on error)"""
         try:
-            with open(html_file_path, 'r', encoding='utf-8') as f:
+            # Hand raw bytes to libxml2 and let it decode them in C
+            with open(html_file_path, 'rb') as f:
                 content = f.read()
             
-            soup = BeautifulSoup(content, 'html.parser')
+            tree = html.fromstring(content, parser=HTML_PARSER)
             modified = False
             
             # Convert all anchor links
-            for link in soup.find_all('a', href=True):
+            for link in tree.xpath('//a[@href]'):
                 href = link.get('href')
                 if href:
                     # Normalize the URL
-                    normalized_url = self.normalize_url(href, 'https://wiki.matriz.org')
+                    normalized_url = self.normalize_url(href, WIKI_URL)
                     
                     if self.is_valid_triz_url(normalized_url):
                         # Check if we have a local file for this URL
                         local_filename = self.get_local_filename_for_url(normalized_url)
                         if local_filename:
                             # Rewrite to local file
-                            link['href'] = local_filename
+                            link.set('href', local_filename)
                             modified = True
                             logger.debug(f"Rewrote link {href} -> {local_filename}")
                         else:
                             # If we don't have this page, disable the link
-                            link['href'] = '#'
-                            link['title'] = f"Page not available offline: {normalized_url}"
-                            link['style'] = 'color: #999; text-decoration: line-through;'
+                            link.attrib.update({
+                                'href': '#',
+                                'title': f"Page not available offline: {normalized_url}",
+                                'style': DISABLED_STYLE
+                            })
                             modified = True
                             logger.debug(f"Disabled link {href} (not available offline)")
-                    elif href.startswith('https://wiki.matriz.org'):
+                    elif href.startswith(WIKI_URL):
                         # External link - keep as is but add target="_blank"
-                        link['target'] = '_blank'
-                        link['rel'] = 'noopener noreferrer'
+                        link.attrib.update(EXTERNAL_LINK_ATTRS)
                         modified = True
             
             # Convert image sources to local files
-            for img in soup.find_all('img'):
+            for img in tree.iter('img'):
                 src = img.get('src')
                 if src:
-                    normalized_url = self.normalize_url(src, 'https://wiki.matriz.org')
-                    if normalized_url.startswith('https://wiki.matriz.org'):
+                    normalized_url = self.normalize_url(src, WIKI_URL)
+                    if normalized_url.startswith(WIKI_URL):
                         # Check if we have this image locally
-                        if os.path.exists(self.images_dir):
+                        if self.images_available:
                             # Find the local image filename
-                            for local_img in os.listdir(self.images_dir):
-                                if local_img.startswith(hashlib.md5(normalized_url.encode()).hexdigest()):
-                                    img['src'] = f"../images/{local_img}"
-                                    modified = True
-                                    logger.debug(f"Rewrote image {src} -> ../images/{local_img}")
-                                    break
+                            local_img = self.image_index.get(url_hash(normalized_url))
+                            if local_img:
+                                img.set('src', f"../images/{local_img}")
+                                modified = True
+                                logger.debug(f"Rewrote image {src} -> ../images/{local_img}")
                         else:
                             # Image not available offline
-                            img['src'] = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZGRkIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzk5OSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPkltYWdlIG5vdCBhdmFpbGFibGUgb2ZmbGluZTwvdGV4dD48L3N2Zz4="
-                            img['alt'] = "Image not available offline"
+                            img.attrib.update({'src': PLACEHOLDER_IMG, 'alt': "Image not available offline"})
                             modified = True
                             logger.debug(f"Replaced offline image {src} with placeholder")
             
             if modified:
-                # Write the modified content back
-                with open(html_file_path, 'w', encoding='utf-8') as f:
-                    f.write(str(soup))
+                # Write the modified content back through libxml2's buffered writer
+                tree.getroottree().write(html_file_path, encoding='utf-8', method='html')
                 return True
             
             return False
             
         except Exception as e:
             logger.error(f"Error converting {html_file_path}: {e}")
-            return False
+            return None
     
     def convert_all_html_files(self):
         """Convert all HTML files to have offline links"""
@@ -175,18 +174,76 @@ class OfflineLinkConverter:
             logger.error(f"HTML directory {self.html_dir} not found")
             return
         
-        html_files = [f for f in os.listdir(self.html_dir) if f.endswith('.html')]
-        logger.info(f"Found {len(html_files)} HTML files to convert")
+        with os.scandir(self.html_dir) as entries:
+            html_entries = [e for e in entries if e.name.endswith('.html') and e.is_file()]
+        logger.info(f"Found {len(html_entries)} HTML files to convert")
         
+        # Skip files untouched since they were converted against the same inputs
+        inputs_hash = self.conversion_inputs_hash()
+        manifest = self.load_manifest()
+        # Forget files that are gone since the last run
+        stale_names = manifest.keys() - {entry.name for entry in html_entries}
+        for name in stale_names:
+            del manifest[name]
+        pending_entries = []
+        for entry in html_entries:
+            cached = manifest.get(entry.name)
+            if (isinstance(cached, dict) and cached.get('mtime_ns') == entry.stat().st_mtime_ns and
+                    cached.get('map_hash') == inputs_hash):
+                continue
+            pending_entries.append(entry)
+        if len(pending_entries) < len(html_entries):
+            logger.info(f"Skipping {len(html_entries) - len(pending_entries)} unchanged HTML files")
+        
+        # Files are independent, so spread the parsing over all cores.
+        # The converter (URL map, image index) is shipped once per worker.
         converted_count = 0
-        for html_file in html_files:
-            html_path = os.path.join(self.html_dir, html_file)
-            if self.convert_html_file_to_offline(html_path):
-                converted_count += 1
-                logger.info(f"Converted {html_file}")
+        if pending_entries:
+            with ProcessPoolExecutor(initializer=init_worker, initargs=(self,)) as executor:
+                results = executor.map(convert_worker, [e.path for e in pending_entries], chunksize=8)
+                for entry, converted in zip(pending_entries, results):
+                    if converted is None:
+                        # Failed; leave it out of the manifest so the next run retries it
+                        continue
+                    # Record files with nothing to rewrite too, so they aren't parsed again
+                    manifest[entry.name] = {
+                        'mtime_ns': os.stat(entry.path).st_mtime_ns,
+                        'map_hash': inputs_hash
+                    }
+                    if converted:
+                        converted_count += 1
+                        logger.info(f"Converted {entry.name}")
         
+        if pending_entries or stale_names:
+            self.save_manifest(manifest)
         logger.info(f"Successfully converted {converted_count} HTML files to offline format")
     
+    def conversion_inputs_hash(self):
+        """Stable hash of everything a conversion depends on besides the file itself"""
+        inputs = [sorted(self.url_to_filename_map.items()), sorted(self.image_index.items())]
+        return hashlib.blake2b(orjson.dumps(inputs)).hexdigest()
+    
+    def load_manifest(self):
+        """Load the record of previously converted files"""
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'rb') as f:
+                    manifest = orjson.loads(f.read())
+                if isinstance(manifest, dict):
+                    return manifest
+                logger.warning("Conversion manifest is not a JSON object, ignoring it")
+            except Exception as e:
+                logger.warning(f"Error loading conversion manifest: {e}")
+        return {}
+    
+    def save_manifest(self, manifest):
+        """Persist the record of converted files for the next run"""
+        try:
+            with open(self.manifest_file, 'wb') as f:
+                f.write(orjson.dumps(manifest))
+        except Exception as e:
+            logger.warning(f"Error saving conversion manifest: {e}")
+    
     def update_sitemap(self):
         """Update the sitemap to show offline navigation"""
         sitemap_file = f"{self.output_dir}/sitemap.html"
@@ -222,11 +279,15 @@ class OfflineLinkConverter:
             )
             
             # Make page titles clickable
-            for url, html_file in self.url_to_filename_map.items():
-                content = content.replace(
-                    f'<div class="title">{html_file}</div>',
-                    f'<div class="title"><a href="html/{html_file}" target="_blank">{html_file}</a></div>'
-                )
+            known_files = set(self.url_to_filename_map.values())
+            
+            def link_title(match):
+                html_file = match.group(1)
+                if html_file not in known_files:
+                    return match.group(0)
+                return f'<div class="title"><a href="html/{html_file}" target="_blank">{html_file}</a></div>'
+            
+            content = SITEMAP_TITLE_RE.sub(link_title, content)
             
             # Write the updated sitemap
             with open(sitemap_file, 'w', encoding='utf-8') as f:
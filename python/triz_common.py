@@ -0,0 +1,112 @@
+"""
+Shared helpers for the TRIZ crawler and offline converters
+Definitions every script must agree on live here so they can't drift apart
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+from contextlib import closing
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse, urlunparse
+
+import orjson
+from lxml import html
+
+logger = logging.getLogger(__name__)
+
+WIKI_URL = "https://wiki.matriz.org"
+TRIZ_SECTION = '/knowledge-base/triz/'
+
+# Absolute URLs that urljoin/urlparse would hand back unchanged: a host, no
+# fragment, params, dot segments or characters urlsplit strips. normalize_url
+# returns these as is instead of taking the slow path.
+_PLAIN_URL_RE = re.compile(r'https?://[\w.:@-]+(?:/(?!\.)[^/?#;\s\x00-\x1f\x7f\[\]]*)*(?:\?[^#\s\x00-\x1f\x7f]+)?\Z', re.ASCII)
+
+# Attributes written onto rewritten elements; the grey "Image not available
+# offline" SVG stands in for images that were never downloaded
+PLACEHOLDER_IMG = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZGRkIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzk5OSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPkltYWdlIG5vdCBhdmFpbGFibGUgb2ZmbGluZTwvdGV4dD48L3N2Zz4="
+DISABLED_STYLE = 'color: #999; text-decoration: line-through;'
+EXTERNAL_LINK_ATTRS = {'target': '_blank', 'rel': 'noopener noreferrer'}
+
+# Fragments and document downloads are never pages
+_EXCLUDED_URL_RE = re.compile(r'#|\.(?:pdf|zip|docx?)\Z')
+
+@lru_cache(maxsize=1 << 16)
+def normalize_url(url, base_url):
+    """Normalize URL to absolute form (the same hrefs recur across pages)"""
+    if url.isascii() and _PLAIN_URL_RE.match(url):
+        return url
+    if url.startswith('#'):
+        return base_url
+    if url.startswith('javascript:'):
+        return base_url
+    if url.startswith('mailto:'):
+        return base_url
+        
+    try:
+        # Resolve against the base and drop the fragment
+        return urlunparse(urlparse(urljoin(base_url, url))._replace(fragment=''))
+    except:
+        return base_url
+
+def is_valid_triz_url(url, base_url=WIKI_URL):
+    """Check if URL is part of the TRIZ knowledge base"""
+    return (url.startswith(base_url) and 
+            TRIZ_SECTION in url and
+            not _EXCLUDED_URL_RE.search(url))
+
+@lru_cache(maxsize=1 << 16)
+def url_hash(url):
+    """MD5 of a URL, the stem of its local html, data or image filename"""
+    return hashlib.md5(url.encode()).hexdigest()
+
+def page_filename(url):
+    """Local HTML filename of the page at url"""
+    return url_hash(url) + '.html'
+
+# The crawler's data.sqlite: one row per page, data holding its orjson-encoded page data
+PAGES_SCHEMA = "CREATE TABLE IF NOT EXISTS pages (html_file TEXT PRIMARY KEY, data BLOB)"
+PAGES_UPSERT = "INSERT OR REPLACE INTO pages (html_file, data) VALUES (?, ?)"
+
+def read_page_rows(db_path):
+    """Read every page's data from the crawler's database, ordered by HTML filename"""
+    try:
+        with closing(sqlite3.connect(db_path)) as db:
+            return [orjson.loads(data) for (data,) in db.execute("SELECT data FROM pages ORDER BY html_file")]
+    except Exception as e:
+        logger.warning(f"Error reading {db_path}: {e}")
+        return []
+
+# Pages are written as UTF-8, so don't let libxml2 guess the encoding
+HTML_PARSER = html.HTMLParser(encoding='utf-8')
+
+# Plain page entries in the crawler's sitemap
+SITEMAP_TITLE_RE = re.compile(r'<div class="title">([^<]*)</div>')
+
+def url_map_file(output_dir):
+    """Path of the crawler's URL map, or of the full summary for crawls from before url_map.json"""
+    summary_file = f"{output_dir}/url_map.json"
+    if not os.path.exists(summary_file):
+        summary_file = f"{output_dir}/crawl_summary.json"
+    return summary_file
+
+def build_image_index(images_dir):
+    """Index local images once by URL hash (the filename stem)"""
+    if not os.path.isdir(images_dir):
+        return {}
+    return {os.path.splitext(image_file)[0]: image_file for image_file in os.listdir(images_dir)}
+
+# Converter shared by the conversion workers of one process pool
+_worker_converter = None
+
+def init_worker(converter):
+    """Install the converter used by conversion workers in this process"""
+    global _worker_converter
+    _worker_converter = converter
+
+def convert_worker(html_file_path):
+    """Convert a single HTML file in a worker process"""
+    return _worker_converter.convert_html_file_to_offline(html_file_path)
@@ -4,25 +4,32 @@ TRIZ Knowledge Base Web Crawler
 Recursively crawls all content and images from the TRIZ wiki
 """
 
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import aiohttp
+from lxml import html
 import urllib.parse
-import os
+import copy
 import time
-import json
+import orjson
 from urllib.robotparser import RobotFileParser
-import hashlib
 from pathlib import Path
 import re
-from typing import Set, Dict, List, Optional
+import sqlite3
+from functools import lru_cache
+from typing import Set, Dict, List, Optional, Tuple
 import logging
 
+from triz_common import DISABLED_STYLE, EXTERNAL_LINK_ATTRS, is_valid_triz_url, normalize_url, page_filename, PAGES_SCHEMA, PAGES_UPSERT, PLACEHOLDER_IMG, url_hash
+
 # Configuration parameters
 BASE_URL = "https://wiki.matriz.org"
 START_URL = "https://wiki.matriz.org/knowledge-base/triz/"
 OUTPUT_DIR = "triz_content"
 MAX_DEPTH = 5
-DELAY_BETWEEN_REQUESTS = 1  # seconds
+DELAY_BETWEEN_REQUESTS = 1  # seconds between page request starts
+CONCURRENCY = 16  # maximum requests in flight
+DATA_COMMIT_BATCH = 64  # page data rows written per database commit
+IMAGE_CHUNK_SIZE = 64 * 1024  # bytes per streamed image write
 MAX_RETRIES = 3
 TIMEOUT = 30
 BYPASS_ROBOTS = True  # Set to True to bypass robots.txt restrictions
@@ -38,91 +45,116 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# A <meta charset> or http-equiv Content-Type declaration, looked for in a page's first KB
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def _html_parser(charset: Optional[str]) -> html.HTMLParser:
+    """Parser that decodes pages in the given charset (None: as the page declares), UTF-8 if it's unknown"""
+    try:
+        return html.HTMLParser(encoding=charset)
+    except LookupError:
+        return _html_parser('utf-8')
+
+class RateLimiter:
+    """Space request starts at least `interval` seconds apart"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_slot = 0.0
+        
+    async def wait(self):
+        """Sleep until this caller's slot comes up"""
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# Heading tag -> level, and every tag extract_all looks at
+_HEADING_LEVELS = {f'h{level}': level for level in range(1, 7)}
+_PAGE_TAGS = ('a', 'img', 'title', *_HEADING_LEVELS, 'p', 'ul', 'ol', 'table', 'meta')
+
+def _declare_utf8(tree: html.HtmlElement):
+    """Point the page's charset declarations at UTF-8, the encoding it is saved in"""
+    for meta in tree.iter('meta'):
+        if meta.get('charset') is not None:
+            meta.set('charset', 'utf-8')
+        elif (meta.get('http-equiv') or '').lower() == 'content-type':
+            # libxml2 drops http-equiv declarations when serializing; keep the HTML5 form
+            meta.attrib.clear()
+            meta.set('charset', 'utf-8')
+
+def element_text(element) -> str:
+    """Concatenate the stripped text pieces of an element"""
+    return ''.join(text.strip() for text in element.itertext())
+
 class TRIZCrawler:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        self.headers = {'User-Agent': self.user_agent}
+        # Opened by crawl_recursively for the lifetime of the crawl
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.rate_limiter = RateLimiter(DELAY_BETWEEN_REQUESTS)
         self.visited_urls: Set[str] = set()
         self.url_content_map: Dict[str, Dict] = {}
         self.image_urls: Set[str] = set()
+        self.image_index: Dict[str, str] = {}  # URL hash -> downloaded image filename
         self.robots_parser = RobotFileParser()
         self.robots_parser.set_url(f"{BASE_URL}/robots.txt")
+        self.robots_cache: Dict[str, bool] = {}  # path and query -> can_fetch result
         
         # Create output directories
         self.setup_directories()
         
+        # Per-page data goes into one database instead of a file per page
+        self.db = sqlite3.connect(f"{OUTPUT_DIR}/data.sqlite")
+        self.db.execute(PAGES_SCHEMA)
+        self.pending_rows = 0
+        
     def setup_directories(self):
         """Create necessary output directories"""
         Path(OUTPUT_DIR).mkdir(exist_ok=True)
         Path(f"{OUTPUT_DIR}/html").mkdir(exist_ok=True)
         Path(f"{OUTPUT_DIR}/images").mkdir(exist_ok=True)
-        Path(f"{OUTPUT_DIR}/data").mkdir(exist_ok=True)
         
     def is_allowed_by_robots(self, url: str) -> bool:
         """Check if URL is allowed by robots.txt"""
         if BYPASS_ROBOTS:
             return True
             
+        # Robots rules only see the path and query, so URLs differing in anything else share a result
+        parsed = urllib.parse.urlsplit(url)
+        key = f"{parsed.path}?{parsed.query}"
+        allowed = self.robots_cache.get(key)
+        if allowed is not None:
+            return allowed
+            
         try:
-            return self.robots_parser.can_fetch(self.session.headers['User-Agent'], url)
+            allowed = self.robots_parser.can_fetch(self.user_agent, url)
+            self.robots_cache[key] = allowed
+            return allowed
         except Exception as e:
             logger.warning(f"Robots.txt check failed: {e}")
             return True  # Default to allowed if robots.txt fails
             
+    def get_filename_for_url(self, url: str) -> Optional[str]:
+        """Local HTML filename of a crawled page, or None if it wasn't crawled"""
+        if url in self.url_content_map:
+            return page_filename(url)
+        return None
+        
     def normalize_url(self, url: str, base_url: str) -> str:
         """Normalize URL to absolute form"""
-        if url.startswith('#'):
-            return base_url
-        if url.startswith('javascript:'):
-            return base_url
-        if url.startswith('mailto:'):
-            return base_url
-            
-        try:
-            parsed = urllib.parse.urljoin(base_url, url)
-            # Remove fragments
-            parsed = urllib.parse.urlparse(parsed)
-            return urllib.parse.urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, parsed.query, ''))
-        except:
-            return base_url
+        return normalize_url(url, base_url)
             
     def is_valid_triz_url(self, url: str) -> bool:
         """Check if URL is part of the TRIZ knowledge base"""
-        return (url.startswith(BASE_URL) and 
-                '/knowledge-base/triz/' in url and
-                not url.endswith(('.pdf', '.zip', '.doc', '.docx')) and
-                '#' not in url)
+        return is_valid_triz_url(url, BASE_URL)
                 
-    def extract_links(self, soup: BeautifulSoup, base_url: str) -> Set[str]:
-        """Extract all valid links from the page"""
-        links = set()
-        
-        for link in soup.find_all('a', href=True):
-            href = link.get('href')
-            normalized_url = self.normalize_url(href, base_url)
-            
-            if self.is_valid_triz_url(normalized_url):
-                links.add(normalized_url)
-                
-        return links
-        
-    def extract_images(self, soup: BeautifulSoup, base_url: str) -> Set[str]:
-        """Extract all image URLs from the page"""
-        images = set()
-        
-        for img in soup.find_all('img'):
-            src = img.get('src')
-            if src:
-                normalized_url = self.normalize_url(src, base_url)
-                if normalized_url.startswith(BASE_URL):
-                    images.add(normalized_url)
-                    
-        return images
-        
-    def extract_text_content(self, soup: BeautifulSoup) -> Dict:
-        """Extract structured text content from the page"""
+    def extract_all(self, tree: html.HtmlElement, base_url: str) -> Tuple[Dict, Set[str], Set[str]]:
+        """Extract text content, valid links and image URLs from the page in one walk"""
         content = {
             'title': '',
             'headings': [],
@@ -132,78 +164,112 @@ class TRIZCrawler:
             'metadata': {}
         }
         
-        # Extract title
-        title_tag = soup.find('title')
-        if title_tag:
-            content['title'] = title_tag.get_text(strip=True)
+        links = set()
+        images = set()
+        # Navigation links repeat many times per page; normalize each distinct href once
+        seen_hrefs = set()
+        seen_srcs = set()
+        
+        # One walk over the tags of interest; headings are bucketed by level
+        # so they come out grouped h1 first, each level in document order
+        headings_by_level = [[] for _ in range(6)]
+        title_found = False
+        
+        for element in tree.iter(*_PAGE_TAGS):
+            tag = element.tag
             
-        # Extract headings
-        for i in range(1, 7):
-            for heading in soup.find_all(f'h{i}'):
-                content['headings'].append({
-                    'level': i,
-                    'text': heading.get_text(strip=True),
-                    'id': heading.get('id', '')
-                })
-                
-        # Extract paragraphs
-        for p in soup.find_all('p'):
-            text = p.get_text(strip=True)
-            if text:
-                content['paragraphs'].append(text)
-                
-        # Extract lists
-        for ul in soup.find_all(['ul', 'ol']):
-            list_items = []
-            for li in ul.find_all('li'):
-                list_items.append(li.get_text(strip=True))
-            if list_items:
-                content['lists'].append({
-                    'type': ul.name,
-                    'items': list_items
+            if tag == 'a':
+                href = element.get('href')
+                if href is not None and href not in seen_hrefs:
+                    seen_hrefs.add(href)
+                    normalized_url = self.normalize_url(href, base_url)
+                    if self.is_valid_triz_url(normalized_url):
+                        links.add(normalized_url)
+                        
+            elif tag == 'img':
+                src = element.get('src')
+                if src and src not in seen_srcs:
+                    seen_srcs.add(src)
+                    normalized_url = self.normalize_url(src, base_url)
+                    if normalized_url.startswith(BASE_URL):
+                        images.add(normalized_url)
+                        
+            elif tag in _HEADING_LEVELS:
+                headings_by_level[_HEADING_LEVELS[tag] - 1].append({
+                    'level': _HEADING_LEVELS[tag],
+                    'text': element_text(element),
+                    'id': element.get('id', '')
                 })
                 
-        # Extract tables
-        for table in soup.find_all('table'):
-            table_data = []
-            for row in table.find_all('tr'):
-                row_data = []
-                for cell in row.find_all(['td', 'th']):
-                    row_data.append(cell.get_text(strip=True))
-                if row_data:
-                    table_data.append(row_data)
-            if table_data:
-                content['tables'].append(table_data)
+            elif tag == 'p':
+                text = element_text(element)
+                if text:
+                    content['paragraphs'].append(text)
+                    
+            elif tag == 'ul' or tag == 'ol':
+                list_items = []
+                for li in element.iter('li'):
+                    list_items.append(element_text(li))
+                if list_items:
+                    content['lists'].append({
+                        'type': tag,
+                        'items': list_items
+                    })
+                    
+            elif tag == 'table':
+                table_data = []
+                for row in element.iter('tr'):
+                    row_data = []
+                    for cell in row.iter('td', 'th'):
+                        row_data.append(element_text(cell))
+                    if row_data:
+                        table_data.append(row_data)
+                if table_data:
+                    content['tables'].append(table_data)
+                    
+            elif tag == 'meta':
+                name = element.get('name') or element.get('property')
+                content_attr = element.get('content')
+                if name and content_attr:
+                    content['metadata'][name] = content_attr
+                    
+            elif tag == 'title' and not title_found:
+                content['title'] = element_text(element)
+                title_found = True
                 
-        # Extract metadata
-        meta_tags = soup.find_all('meta')
-        for meta in meta_tags:
-            name = meta.get('name') or meta.get('property')
-            content_attr = meta.get('content')
-            if name and content_attr:
-                content['metadata'][name] = content_attr
+        for headings in headings_by_level:
+            content['headings'].extend(headings)
                 
-        return content
+        return content, links, images
         
-    def download_image(self, image_url: str) -> bool:
+    async def download_image(self, image_url: str) -> bool:
         """Download an image and save it locally"""
         try:
-            response = self.session.get(image_url, timeout=TIMEOUT)
-            if response.status_code == 200:
-                # Create filename from URL
-                filename = hashlib.md5(image_url.encode()).hexdigest()
-                extension = self.get_image_extension(image_url, response.headers.get('content-type', ''))
-                filename = f"{filename}{extension}"
-                
-                filepath = Path(f"{OUTPUT_DIR}/images/{filename}")
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+            async with self.semaphore, self.session.get(image_url) as response:
+                if response.status == 200:
+                    # Create filename from URL
+                    stem = url_hash(image_url)
+                    extension = self.get_image_extension(image_url, response.headers.get('content-type', ''))
+                    filename = f"{stem}{extension}"
                     
-                logger.info(f"Downloaded image: {image_url} -> {filename}")
-                return True
-            else:
-                logger.warning(f"Failed to download image {image_url}: {response.status_code}")
-                return False
+                    # Stream to a partial file so a dropped connection never leaves a truncated image
+                    filepath = Path(f"{OUTPUT_DIR}/images/{filename}")
+                    partial_path = filepath.with_name(filename + '.part')
+                    try:
+                        with open(partial_path, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                                f.write(chunk)
+                        partial_path.replace(filepath)
+                    finally:
+                        # Already renamed on success; otherwise drop the truncated download
+                        partial_path.unlink(missing_ok=True)
+                    self.image_index[stem] = filename
+                        
+                    logger.info(f"Downloaded image: {image_url} -> {filename}")
+                    return True
+                else:
+                    logger.warning(f"Failed to download image {image_url}: {response.status}")
+                    return False
         except Exception as e:
             logger.error(f"Error downloading image {image_url}: {e}")
             return False
@@ -239,7 +305,7 @@ class TRIZCrawler:
             
         return '.jpg'  # Default
         
-    def crawl_page(self, url: str, depth: int = 0) -> Optional[Dict]:
+    async def crawl_page(self, url: str, depth: int = 0) -> Optional[Dict]:
         """Crawl a single page and extract all content"""
         if depth > MAX_DEPTH or url in self.visited_urls:
             return None
@@ -251,29 +317,34 @@ class TRIZCrawler:
         logger.info(f"Crawling {url} (depth: {depth})")
         
         try:
-            response = self.session.get(url, timeout=TIMEOUT)
-            if response.status_code != 200:
-                logger.warning(f"Failed to fetch {url}: {response.status_code}")
-                return None
+            await self.rate_limiter.wait()
+            async with self.semaphore, self.session.get(url) as response:
+                if response.status != 200:
+                    logger.warning(f"Failed to fetch {url}: {response.status}")
+                    return None
+                body = await response.read()
+                charset = response.charset
+                if not charset and not _META_CHARSET_RE.search(body, 0, 1024):
+                    # Without this libxml2 reads a UTF-8 page lacking <meta charset> as Latin-1
+                    charset = 'utf-8'
+                parser = _html_parser(charset)
                 
-            soup = BeautifulSoup(response.content, 'html.parser')
+            tree = html.fromstring(body, parser=parser)
             
             # Extract content
-            content = self.extract_text_content(soup)
-            links = self.extract_links(soup, url)
-            images = self.extract_images(soup, url)
+            content, links, images = self.extract_all(tree, url)
             
-            # Download images
-            for image_url in images:
-                if image_url not in self.image_urls:
-                    self.download_image(image_url)
-                    self.image_urls.add(image_url)
+            # Download new images in parallel
+            new_images = images - self.image_urls
+            self.image_urls.update(new_images)
+            await asyncio.gather(*(self.download_image(image_url) for image_url in new_images))
                     
             # Save HTML content
-            html_filename = hashlib.md5(url.encode()).hexdigest() + '.html'
+            html_filename = page_filename(url)
             html_filepath = Path(f"{OUTPUT_DIR}/html/{html_filename}")
+            _declare_utf8(tree)
             with open(html_filepath, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
+                f.write(html.tostring(tree.getroottree(), encoding='unicode'))
                 
             # Create page data
             page_data = {
@@ -291,9 +362,7 @@ class TRIZCrawler:
             self.visited_urls.add(url)
             
             # Save individual page data
-            page_filename = f"{OUTPUT_DIR}/data/{html_filename.replace('.html', '.json')}"
-            with open(page_filename, 'w', encoding='utf-8') as f:
-                json.dump(page_data, f, indent=2, ensure_ascii=False)
+            self.save_page_data(html_filename, page_data)
                 
             logger.info(f"Successfully crawled {url}")
             return page_data
@@ -302,25 +371,54 @@ class TRIZCrawler:
             logger.error(f"Error crawling {url}: {e}")
             return None
             
-    def crawl_recursively(self, start_url: str):
+    def save_page_data(self, html_filename: str, page_data: Dict):
+        """Store a page's data row, committing once per DATA_COMMIT_BATCH pages"""
+        self.db.execute(PAGES_UPSERT, (html_filename, orjson.dumps(page_data)))
+        self.pending_rows += 1
+        if self.pending_rows >= DATA_COMMIT_BATCH:
+            self.db.commit()
+            self.pending_rows = 0
+            
+    async def crawl_recursively(self, start_url: str):
         """Recursively crawl all pages starting from the given URL"""
-        to_visit = [(start_url, 0)]
+        # Breadth-first one level at a time: every page at depth d finishes before any
+        # page at d + 1 starts, so a page's depth is its shortest link path however
+        # quickly the responses along each path come back
+        frontier = [start_url]
+        # Dedupe on the way in so the frontier holds each page once
+        queued: Set[str] = {start_url}
+        depth = 0
         
-        while to_visit:
-            current_url, depth = to_visit.pop(0)
-            
-            if current_url in self.visited_urls:
-                continue
-                
-            page_data = self.crawl_page(current_url, depth)
-            if page_data:
-                # Add new links to visit
-                for link in page_data['links']:
-                    if link not in self.visited_urls:
-                        to_visit.append((link, depth + 1))
-                        
-            # Respect rate limiting
-            time.sleep(DELAY_BETWEEN_REQUESTS)
+        self.semaphore = asyncio.Semaphore(CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+        async with aiohttp.ClientSession(headers=self.headers, timeout=timeout) as session:
+            self.session = session
+            try:
+                while frontier and depth <= MAX_DEPTH:
+                    # The semaphore keeps at most CONCURRENCY requests of the level in flight
+                    results = await asyncio.gather(*(self.crawl_page(url, depth) for url in frontier))
+                    
+                    # Pages that failed are retried if a later page links to them again
+                    for url, page_data in zip(frontier, results):
+                        if not page_data:
+                            queued.discard(url)
+                            
+                    next_frontier = []
+                    if depth < MAX_DEPTH:
+                        for page_data in results:
+                            if page_data:
+                                # Add new links to visit
+                                for link in page_data['links']:
+                                    if link not in queued:
+                                        queued.add(link)
+                                        next_frontier.append(link)
+                    frontier = next_frontier
+                    depth += 1
+            finally:
+                self.session = None
+                # Flush the last partial batch of page data
+                self.db.commit()
+                self.pending_rows = 0
             
     def save_summary(self):
         """Save a summary of all crawled content"""
@@ -334,14 +432,25 @@ class TRIZCrawler:
         }
         
         summary_file = f"{OUTPUT_DIR}/crawl_summary.json"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2, ensure_ascii=False)
+        with open(summary_file, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
+            
+        # The converters only need these fields, so spare them parsing every page's content
+        url_map = {
+            'pages': [
+                {'url': data['url'], 'html_file': data['html_file'], 'title': data['title']}
+                for data in self.url_content_map.values()
+            ]
+        }
+        url_map_file = f"{OUTPUT_DIR}/url_map.json"
+        with open(url_map_file, 'wb') as f:
+            f.write(orjson.dumps(url_map))
             
         logger.info(f"Summary saved to {summary_file}")
         
     def generate_sitemap(self):
         """Generate an HTML sitemap"""
-        sitemap_html = f"""
+        parts = [f"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -368,10 +477,10 @@ class TRIZCrawler:
     </div>
     
     <h2>Pages</h2>
-"""
+"""]
         
         for url, data in self.url_content_map.items():
-            sitemap_html += f"""
+            parts.append(f"""
     <div class="page">
         <div class="title">{data['title']}</div>
         <div class="url">{data['url']}</div>
@@ -382,12 +491,13 @@ class TRIZCrawler:
             <p><strong>HTML File:</strong> {data['html_file']}</p>
         </div>
     </div>
-"""
+""")
             
-        sitemap_html += """
+        parts.append("""
 </body>
 </html>
-"""
+""")
+        sitemap_html = "".join(parts)
         
         sitemap_file = f"{OUTPUT_DIR}/sitemap.html"
         with open(sitemap_file, 'w', encoding='utf-8') as f:
@@ -395,13 +505,13 @@ class TRIZCrawler:
             
         logger.info(f"Sitemap saved to {sitemap_file}")
 
-    def rewrite_links_to_offline(self, soup: BeautifulSoup, base_url: str) -> BeautifulSoup:
+    def rewrite_links_to_offline(self, tree: html.HtmlElement, base_url: str) -> html.HtmlElement:
         """Rewrite all internal links to point to local HTML files"""
         # Create a copy to avoid modifying the original
-        soup_copy = soup.copy()
+        tree_copy = copy.deepcopy(tree)
         
         # Rewrite all anchor links
-        for link in soup_copy.find_all('a', href=True):
+        for link in tree_copy.xpath('//a[@href]'):
             href = link.get('href')
             if href:
                 normalized_url = self.normalize_url(href, base_url)
@@ -411,21 +521,22 @@ class TRIZCrawler:
                     local_filename = self.get_filename_for_url(normalized_url)
                     if local_filename:
                         # Rewrite to local file
-                        link['href'] = local_filename
+                        link.set('href', local_filename)
                         logger.debug(f"Rewrote link {href} -> {local_filename}")
                     else:
                         # If we don't have this page, remove the link or make it non-functional
-                        link['href'] = '#'
-                        link['title'] = f"Page not available offline: {normalized_url}"
-                        link['style'] = 'color: #999; text-decoration: line-through;'
+                        link.attrib.update({
+                            'href': '#',
+                            'title': f"Page not available offline: {normalized_url}",
+                            'style': DISABLED_STYLE
+                        })
                         logger.debug(f"Disabled link {href} (not available offline)")
                 elif href.startswith(BASE_URL):
                     # External link - keep as is but add target="_blank"
-                    link['target'] = '_blank'
-                    link['rel'] = 'noopener noreferrer'
+                    link.attrib.update(EXTERNAL_LINK_ATTRS)
         
         # Rewrite image sources to local files
-        for img in soup_copy.find_all('img'):
+        for img in tree_copy.iter('img'):
             src = img.get('src')
             if src:
                 normalized_url = self.normalize_url(src, base_url)
@@ -433,21 +544,16 @@ class TRIZCrawler:
                     # Check if we have this image locally
                     if normalized_url in self.image_urls:
                         # Find the local image filename
-                        try:
-                            for local_img in os.listdir(f"{OUTPUT_DIR}/images"):
-                                if local_img.startswith(hashlib.md5(normalized_url.encode()).hexdigest()):
-                                    img['src'] = f"../images/{local_img}"
-                                    logger.debug(f"Rewrote image {src} -> ../images/{local_img}")
-                                    break
-                        except Exception as e:
-                            logger.warning(f"Error processing image {src}: {e}")
+                        local_img = self.image_index.get(url_hash(normalized_url))
+                        if local_img:
+                            img.set('src', f"../images/{local_img}")
+                            logger.debug(f"Rewrote image {src} -> ../images/{local_img}")
                     else:
                         # Image not available offline
-                        img['src'] = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEwMCIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZGRkIi8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCIgZm9udC1zaXplPSIxNCIgZmlsbD0iIzk5OSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPkltYWdlIG5vdCBhdmFpbGFibGUgb2ZmbGluZTwvdGV4dD48L3N2Zz4="
-                        img['alt'] = "Image not available offline"
+                        img.attrib.update({'src': PLACEHOLDER_IMG, 'alt': "Image not available offline"})
                         logger.debug(f"Replaced offline image {src} with placeholder")
         
-        return soup_copy
+        return tree_copy
 
 def main():
     """Main function to run the crawler"""
@@ -456,7 +562,7 @@ def main():
     
     try:
         crawler = TRIZCrawler()
-        crawler.crawl_recursively(START_URL)
+        asyncio.run(crawler.crawl_recursively(START_URL))
         
         # Save results
         crawler.save_summary()